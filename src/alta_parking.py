@@ -1,25 +1,52 @@
 """
-Alta Parking availability checker using Playwright to bypass Cloudflare.
+Alta Parking availability checker that talks to HONK directly and uses Playwright to bypass Cloudflare.
 
 Uses the HONK Mobile GraphQL API to check parking availability at Alta Ski Area.
-Maintains a persistent browser instance for efficiency.
+Availability checks are direct HTTP calls made with httpx. A persistent Playwright
+browser is only used to get past Cloudflare and capture a cart + clearance cookie,
+which are reused until they expire or get rejected.
+
+All browser state is per process: under gunicorn each worker runs its own browser and pool.
 """
 
 import asyncio
+import time
+from contextlib import asynccontextmanager, suppress
+from dataclasses import dataclass
 from datetime import datetime
-from playwright.async_api import async_playwright, Browser, BrowserContext, Playwright
+import httpx
+from playwright.async_api import async_playwright, Browser, BrowserContext, Error, Page, Playwright, Route
 
 
 ALTA_URL = "https://reserve.altaparking.com/select-parking"
+ALTA_ORIGIN = "https://reserve.altaparking.com"
 GRAPHQL_URL = "https://platform.honkmobile.com/graphql"
 HONK_GUID = "qc0kp53m7wnb2mb8ldl2fc"
+USER_AGENT = 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36'
+
+CHANGE_CART_START_TIME_QUERY = "mutation ChangeCartStartTime($input: ChangeCartStartTimeInput!) { changeCartStartTime(input: $input) { cart { hashid startTime } errors } }"
+GET_RATES_QUERY = "query GetRates($cartId: ID!) { v2CartRates(cartId: $cartId) { hashid price description promoRate behaviourType freeFlag } }"
 
 # Global browser state
 _playwright: Playwright | None = None
 _browser: Browser | None = None
-_lock = asyncio.Lock()
-_request_count = 0
-MAX_REQUESTS_BEFORE_RESTART = 100  # Restart browser periodically to prevent memory leaks
+_lock = asyncio.Lock()  # Guards browser launch/restart, not individual checks
+
+# Shared HTTP client for direct GraphQL calls (connection pooling + HTTP/2)
+_http_client: httpx.AsyncClient | None = None
+
+# Pool of browser contexts, each owning its own cart. A slot is checked out for a whole
+# check since the cart is stateful, but different slots never wait on each other.
+POOL_SIZE = 4
+MAX_USES_PER_CONTEXT = 25  # Recycle contexts periodically to prevent memory leaks
+SESSION_TTL_SECONDS = 30 * 60
+PAGE_LOAD_TIMEOUT_SECONDS = 5.0  # Upper bound on waiting for the page's cart + calendar calls
+
+# Latest availability calendar seen by any slot, used to skip checks for closed dates
+_calendar: dict | None = None
+_calendar_fetched_at = 0.0
+CALENDAR_TTL_SECONDS = 10 * 60
+UNAVAILABLE_CALENDAR_STATUSES = frozenset({"unavailable", "closed", "sold_out"})
 
 # Chromium args optimized for low memory usage in containers
 BROWSER_ARGS = [
@@ -35,6 +62,41 @@ BROWSER_ARGS = [
     # Note: --single-process removed - causes instability when closing contexts
 ]
 
+# Resources the page doesn't need to fire its GraphQL calls (scripts, XHR/fetch and documents still load)
+BLOCKED_RESOURCE_TYPES = frozenset({'image', 'font', 'media', 'stylesheet'})
+
+
+@dataclass
+class _HonkSession:
+    """Warm state captured from a real browser visit and reused for direct API calls."""
+    cart_id: str
+    cf_clearance: str | None
+    user_agent: str
+    availability_calendar: dict | None
+    created_at: float
+
+    def is_expired(self) -> bool:
+        return time.monotonic() - self.created_at > SESSION_TTL_SECONDS
+
+
+@dataclass
+class _PoolSlot:
+    """A pooled browser context, its long-lived page and the session captured with it."""
+    context: BrowserContext | None = None
+    page: Page | None = None
+    session: _HonkSession | None = None
+    uses: int = 0
+
+
+_slots = [_PoolSlot() for _ in range(POOL_SIZE)]
+_pool: asyncio.Queue[_PoolSlot] = asyncio.Queue()
+for _slot in _slots:
+    _pool.put_nowait(_slot)
+
+
+class _SessionRejected(Exception):
+    """Raised when Cloudflare rejects a direct API call and the session must be recaptured."""
+
 
 async def _launch_browser() -> Browser:
     """Launch browser with memory-optimized settings."""
@@ -42,9 +104,16 @@ async def _launch_browser() -> Browser:
 
 
 async def init_browser() -> None:
-    """Initialize the persistent browser instance. Call on app startup."""
+    """
+    Initialize the persistent browser, its context pool and the HTTP client. Call on app startup.
+
+    Every slot loads the parking page and captures a session concurrently, so the first checks
+    skip the page load. Failures are ignored; the slot simply captures again on first use.
+    """
     global _playwright, _browser
 
+    _get_http_client()
+
     async with _lock:
         if _browser is not None:
             return  # Already initialized
@@ -52,10 +121,29 @@ async def init_browser() -> None:
         _playwright = await async_playwright().start()
         _browser = await _launch_browser()
 
+    await asyncio.gather(*(_warm_slot() for _ in _slots), return_exceptions=True)
+
+
+async def _warm_slot() -> None:
+    """Check out a pool slot and capture its session."""
+    async with _checkout_slot() as slot:
+        await _get_session(slot)
+
 
 async def close_browser() -> None:
-    """Close the browser instance. Call on app shutdown."""
-    global _playwright, _browser, _request_count
+    """Close the browser instance and HTTP client. Call on app shutdown."""
+    global _playwright, _browser, _http_client
+
+    if _http_client:
+        await _http_client.aclose()
+        _http_client = None
+
+    # Contexts close with the browser; pages and sessions are dropped along with them
+    for slot in _slots:
+        slot.context = None
+        slot.page = None
+        slot.session = None
+        slot.uses = 0
 
     async with _lock:
         if _browser:
@@ -64,22 +152,13 @@ async def close_browser() -> None:
         if _playwright:
             await _playwright.stop()
             _playwright = None
-        _request_count = 0
 
 
-async def _get_fresh_context() -> BrowserContext:
-    """Get a fresh browser context, restarting browser if needed."""
-    global _browser, _playwright, _request_count
+async def _new_context() -> BrowserContext:
+    """Create a new browser context, relaunching the browser if needed."""
+    global _browser, _playwright
 
     async with _lock:
-        _request_count += 1
-
-        # Restart browser periodically to prevent memory leaks
-        if _request_count >= MAX_REQUESTS_BEFORE_RESTART and _browser:
-            await _browser.close()
-            _browser = await _launch_browser()
-            _request_count = 0
-
         # Ensure browser is running (handle crashes)
         if _browser is None or not _browser.is_connected():
             if _playwright is None:
@@ -89,110 +168,321 @@ async def _get_fresh_context() -> BrowserContext:
         # Create context inside lock to prevent race conditions
         context = await _browser.new_context(
             viewport={'width': 1920, 'height': 1080},
-            user_agent='Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
+            user_agent=USER_AGENT,
             locale='en-US',
             timezone_id='America/Denver'
         )
         return context
 
 
-async def check_parking_availability(target_date: str) -> dict:
-    """
-    Check parking availability at Alta for a specific date.
+def _get_http_client() -> httpx.AsyncClient:
+    """Get the shared HTTP client, creating it if needed."""
+    global _http_client
 
-    Args:
-        target_date: Date string in YYYY-MM-DD format (e.g., "2025-01-15")
+    if _http_client is None or _http_client.is_closed:
+        _http_client = httpx.AsyncClient(http2=True, timeout=10.0)
+    return _http_client
 
-    Returns:
-        dict with keys:
-            - available: bool indicating if parking is available
-            - date: the requested date
-            - rates: list of available rates (if any)
-            - calendar_status: status from availability calendar (if available)
-            - error: error message (if any)
-    """
-    context = await _get_fresh_context()
 
+@asynccontextmanager
+async def _checkout_slot():
+    """Check a slot out of the pool for the duration of a check, returning it afterwards."""
+    slot = await _pool.get()
     try:
-        page = await context.new_page()
+        yield slot
+    finally:
+        _pool.put_nowait(slot)
+
+
+async def _block_static_assets(route: Route) -> None:
+    """Abort requests for resource types in BLOCKED_RESOURCE_TYPES and let everything else through."""
+    if route.request.resource_type in BLOCKED_RESOURCE_TYPES:
+        await route.abort()
+    else:
+        await route.continue_()
+
+
+async def _prepare_page(slot: _PoolSlot) -> Page:
+    """Get the slot's warm page ready for a page load, recycling its context once it is worn out."""
+    if slot.context is not None and slot.uses >= MAX_USES_PER_CONTEXT:
+        await slot.context.close()
+        slot.context = None
+        slot.page = None
+
+    if slot.context is None:
+        slot.context = await _new_context()
+        slot.uses = 0
+    else:
+        # Cheaper than a fresh context; each capture should start from a clean Cloudflare state
+        await slot.context.clear_cookies()
+
+    if slot.page is None or slot.page.is_closed():
+        slot.page = await slot.context.new_page()
 
         # Remove webdriver detection
-        await page.add_init_script('Object.defineProperty(navigator, "webdriver", {get: () => undefined})')
+        await slot.page.add_init_script('Object.defineProperty(navigator, "webdriver", {get: () => undefined})')
+
+        # Skip downloading and rendering static assets
+        await slot.page.route('**/*', _block_static_assets)
+
+    slot.uses += 1
+    return slot.page
+
+
+async def _discard_context(slot: _PoolSlot) -> None:
+    """Close the slot's context so the next capture creates a fresh one."""
+    context, slot.context, slot.page = slot.context, None, None
+    if context is not None:
+        with suppress(Exception):
+            await context.close()
+
+
+async def _capture_session(slot: _PoolSlot) -> _HonkSession | None:
+    """
+    Load the Alta parking page on the slot's warm page to pass Cloudflare and capture a session.
+
+    Returns:
+        A fresh _HonkSession, or None if the page never created a cart
+    """
+    page = None
+
+    try:
+        page = await _prepare_page(slot)
 
         # Variables to capture from initial page load
         cart_id = None
         availability_calendar = None
+        ready = asyncio.Event()  # Set once both the cart and the calendar have been seen
 
         async def capture_response(response):
             nonlocal cart_id, availability_calendar
-            if 'graphql' in response.url:
-                try:
-                    body = await response.json()
-                    data = body.get('data', {})
-                    if 'createCart' in data and data['createCart'].get('cart'):
-                        cart_id = data['createCart']['cart']['hashid']
-                    if 'publicParkingAvailability' in data:
-                        availability_calendar = data['publicParkingAvailability']
-                except:
-                    pass
+            # Skip preflights, 204s and non-JSON errors without reading their bodies
+            if 'graphql' not in response.url or response.request.method != 'POST':
+                return
+            if not response.headers.get('content-type', '').startswith('application/json'):
+                return
+
+            try:
+                body = await response.json()
+            except (Error, ValueError):
+                return  # Body went away with a navigation, or was malformed
+
+            data = body.get('data') if isinstance(body, dict) else None
+            if not isinstance(data, dict):
+                return
+            # Failed mutations come back as {"createCart": null, "errors": [...]}
+            hashid = ((data.get('createCart') or {}).get('cart') or {}).get('hashid')
+            if hashid:
+                cart_id = hashid
+            if 'publicParkingAvailability' in data:
+                availability_calendar = data['publicParkingAvailability']
+            if cart_id and availability_calendar is not None:
+                ready.set()
 
         page.on('response', capture_response)
 
-        # Navigate to Alta parking page
+        # Navigate to Alta parking page and wait for its GraphQL calls, up to a timeout
         await page.goto(ALTA_URL, wait_until='domcontentloaded')
-        await page.wait_for_timeout(5000)
+        try:
+            await asyncio.wait_for(ready.wait(), timeout=PAGE_LOAD_TIMEOUT_SECONDS)
+        except TimeoutError:
+            pass  # Fall through with whatever was captured
 
         if not cart_id:
+            # Don't reload the same storage into the next capture; start over with a fresh context
+            await _discard_context(slot)
+            return None
+
+        if availability_calendar is not None:
+            _remember_calendar(availability_calendar)
+
+        cookies = await slot.context.cookies(GRAPHQL_URL)
+        cf_clearance = next((c['value'] for c in cookies if c['name'] == 'cf_clearance'), None)
+
+        return _HonkSession(
+            cart_id=cart_id,
+            cf_clearance=cf_clearance,
+            user_agent=USER_AGENT,
+            availability_calendar=availability_calendar,
+            created_at=time.monotonic(),
+        )
+    except Exception:
+        # The context may have died with the browser; replace it on the next capture
+        await _discard_context(slot)
+        raise
+    finally:
+        # The page stays open on the parking app for the next capture
+        if page is not None:
+            page.remove_listener('response', capture_response)
+
+
+def _remember_calendar(calendar: dict) -> None:
+    """Store the latest availability calendar at module scope."""
+    global _calendar, _calendar_fetched_at
+
+    _calendar = calendar
+    _calendar_fetched_at = time.monotonic()
+
+
+def _get_cached_calendar() -> dict | None:
+    """Get the module-level availability calendar, or None if missing or older than the TTL."""
+    if _calendar is None or time.monotonic() - _calendar_fetched_at > CALENDAR_TTL_SECONDS:
+        return None
+    return _calendar
+
+
+def _calendar_status(calendar: dict | None, date_key: str) -> str | None:
+    """Look up the status for a date key in an availability calendar."""
+    if calendar and date_key in calendar:
+        return calendar[date_key].get('status')
+    return None
+
+
+async def _get_session(slot: _PoolSlot, force_refresh: bool = False) -> _HonkSession | None:
+    """Get the slot's session, recapturing it with the browser if missing, expired or forced."""
+    if force_refresh or slot.session is None or slot.session.is_expired():
+        slot.session = await _capture_session(slot)
+    return slot.session
+
+
+async def _graphql(session: _HonkSession, operation_name: str, query: str, variables: dict) -> dict:
+    """
+    POST a GraphQL operation to HONK directly, replaying the captured session.
+
+    Raises:
+        _SessionRejected: if Cloudflare blocks the request (403/503)
+    """
+    headers = {
+        "User-Agent": session.user_agent,
+        "Origin": ALTA_ORIGIN,
+        "Referer": ALTA_URL,
+    }
+    if session.cf_clearance:
+        headers["Cookie"] = f"cf_clearance={session.cf_clearance}"
+
+    response = await _get_http_client().post(
+        GRAPHQL_URL,
+        params={"honkGUID": HONK_GUID},
+        headers=headers,
+        json={"operationName": operation_name, "variables": variables, "query": query},
+    )
+    if response.status_code in (403, 503):
+        raise _SessionRejected(f"{operation_name} rejected with HTTP {response.status_code}")
+    response.raise_for_status()
+
+    body = response.json()
+    if _is_auth_error(body):
+        raise _SessionRejected(f"{operation_name} rejected: {body['errors']}")
+    return body
+
+
+def _is_auth_error(body: dict) -> bool:
+    """Check whether a GraphQL response failed because the cart or session is no longer accepted."""
+    for error in body.get('errors') or []:
+        code = (error.get('extensions') or {}).get('code', '')
+        message = error.get('message', '').lower()
+        if code in ('UNAUTHENTICATED', 'FORBIDDEN') or 'unauthorized' in message or 'not authorized' in message:
+            return True
+    return False
+
+
+async def _fetch_rates(session: _HonkSession, start_time: str) -> list[dict] | None:
+    """
+    Move the session's cart to start_time and return the rates offered for it.
+
+    Returns None if the cart was not moved, so the rates would be for the wrong date.
+    """
+    change_response = await _graphql(
+        session,
+        "ChangeCartStartTime",
+        CHANGE_CART_START_TIME_QUERY,
+        {"input": {"id": session.cart_id, "startTime": start_time}},
+    )
+    change = (change_response.get('data') or {}).get('changeCartStartTime') or {}
+    if change.get('errors') or not _is_start_time(change.get('cart'), start_time):
+        return None
+
+    rates_response = await _graphql(session, "GetRates", GET_RATES_QUERY, {"cartId": session.cart_id})
+
+    if rates_response and 'data' in rates_response:
+        return rates_response['data'].get('v2CartRates') or []
+    return []
+
+
+def _is_start_time(cart: dict | None, start_time: str) -> bool:
+    """Check the cart starts at start_time; HONK may echo the same instant in another offset or precision."""
+    returned = (cart or {}).get('startTime')
+    if not returned:
+        return False
+    try:
+        return datetime.fromisoformat(returned) == datetime.fromisoformat(start_time)
+    except ValueError:
+        return False
+
+
+def _error_result(target_date: str, error: str) -> dict:
+    """Build the result dict for a failed availability check."""
+    return {
+        "available": False,
+        "date": target_date,
+        "rates": [],
+        "calendar_status": None,
+        "error": error
+    }
+
+
+async def check_parking_availability(target_date: str) -> dict:
+    """
+    Check parking availability at Alta for a specific date.
+
+    Args:
+        target_date: Date string in YYYY-MM-DD format (e.g., "2025-01-15")
+
+    Returns:
+        dict with keys:
+            - available: bool indicating if parking is available
+            - date: the requested date
+            - rates: list of available rates (if any)
+            - calendar_status: status from availability calendar (if available)
+            - error: error message (if any)
+    """
+    try:
+        # Parse the target date and format for API
+        dt = datetime.strptime(target_date, "%Y-%m-%d")
+        start_time = dt.strftime("%Y-%m-%dT06:00:00-07:00")
+        date_key = dt.strftime("%Y-%m-%dT00:00:00-07:00")
+
+        # Dates the calendar already reports as closed have no rates; skip the cart round-trip
+        calendar_status = _calendar_status(_get_cached_calendar(), date_key)
+        if isinstance(calendar_status, str) and calendar_status.lower() in UNAVAILABLE_CALENDAR_STATUSES:
             return {
                 "available": False,
                 "date": target_date,
                 "rates": [],
-                "calendar_status": None,
-                "error": "Failed to create cart - page may not have loaded"
+                "calendar_status": calendar_status,
+                "error": None
             }
 
-        # Parse the target date and format for API
-        dt = datetime.strptime(target_date, "%Y-%m-%d")
-        start_time = dt.strftime("%Y-%m-%dT06:00:00-07:00")
+        async with _checkout_slot() as slot:
+            session = await _get_session(slot)
+            if session is None:
+                return _error_result(target_date, "Failed to create cart - page may not have loaded")
 
-        # Check calendar status for this date if available
-        calendar_status = None
-        if availability_calendar:
-            date_key = dt.strftime("%Y-%m-%dT00:00:00-07:00")
-            if date_key in availability_calendar:
-                calendar_status = availability_calendar[date_key].get('status')
-
-        # Change cart to target date and get rates
-        rates_response = await page.evaluate('''
-            async ([cartId, startTime, graphqlUrl, honkGuid]) => {
-                // Change cart start time
-                await fetch(`${graphqlUrl}?honkGUID=${honkGuid}`, {
-                    method: "POST",
-                    headers: {"Content-Type": "application/json"},
-                    body: JSON.stringify({
-                        operationName: "ChangeCartStartTime",
-                        variables: {input: {id: cartId, startTime: startTime}},
-                        query: "mutation ChangeCartStartTime($input: ChangeCartStartTimeInput!) { changeCartStartTime(input: $input) { cart { hashid startTime } errors } }"
-                    })
-                });
-
-                // Get rates for the cart
-                const ratesResp = await fetch(`${graphqlUrl}?honkGUID=${honkGuid}`, {
-                    method: "POST",
-                    headers: {"Content-Type": "application/json"},
-                    body: JSON.stringify({
-                        operationName: "GetRates",
-                        variables: {cartId: cartId},
-                        query: "query GetRates($cartId: ID!) { v2CartRates(cartId: $cartId) { hashid price description promoRate behaviourType freeFlag } }"
-                    })
-                });
-                return await ratesResp.json();
-            }
-        ''', [cart_id, start_time, GRAPHQL_URL, HONK_GUID])
+            try:
+                rates = await _fetch_rates(session, start_time)
+            except _SessionRejected:
+                # Clearance went stale before the TTL; recapture once and retry
+                session = await _get_session(slot, force_refresh=True)
+                if session is None:
+                    return _error_result(target_date, "Failed to create cart - page may not have loaded")
+                rates = await _fetch_rates(session, start_time)
+
+        if rates is None:
+            return _error_result(target_date, "Failed to change cart start time")
 
-        rates = []
-        if rates_response and 'data' in rates_response:
-            rates = rates_response['data'].get('v2CartRates') or []
+        # Fall back to the calendar captured with this session
+        if calendar_status is None:
+            calendar_status = _calendar_status(session.availability_calendar, date_key)
 
         return {
             "available": len(rates) > 0,
@@ -203,12 +493,49 @@ async def check_parking_availability(target_date: str) -> dict:
         }
 
     except Exception as e:
-        return {
-            "available": False,
-            "date": target_date,
-            "rates": [],
-            "calendar_status": None,
-            "error": str(e)
-        }
-    finally:
-        await context.close()
+        return _error_result(target_date, str(e))
+
+
+async def check_parking_availability_batch(target_dates: list[str]) -> dict[str, dict]:
+    """
+    Check parking availability at Alta for several dates concurrently.
+
+    Each cart holds a single start time, so checks fan out across the context pool
+    (one slot per in-flight date) rather than sharing a cart.
+
+    Args:
+        target_dates: Date strings in YYYY-MM-DD format
+
+    Returns:
+        dict mapping each date to the same result dict as check_parking_availability
+    """
+    dates = list(dict.fromkeys(target_dates))
+    results = await asyncio.gather(*(check_parking_availability(date) for date in dates))
+    return dict(zip(dates, results))
+
+
+async def get_availability_calendar() -> dict:
+    """
+    Get the Alta parking availability calendar, reloading the page once it is older than CALENDAR_TTL_SECONDS.
+
+    Returns:
+        dict with keys:
+            - calendar: mapping of date keys (e.g. "2025-01-15T00:00:00-07:00") to status info
+            - error: error message (if any)
+    """
+    calendar = _get_cached_calendar()
+    if calendar is not None:
+        return {"calendar": calendar, "error": None}
+
+    try:
+        async with _checkout_slot() as slot:
+            # The slot's session may be older than the calendar TTL, so capture a fresh one
+            session = await _get_session(slot, force_refresh=True)
+
+        if session is None:
+            return {"calendar": None, "error": "Failed to create cart - page may not have loaded"}
+
+        return {"calendar": session.availability_calendar, "error": None}
+
+    except Exception as e:
+        return {"calendar": None, "error": str(e)}
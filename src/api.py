@@ -1,70 +1,197 @@
+import asyncio
+import hashlib
 import time
 from contextlib import asynccontextmanager
-from fastapi import FastAPI, HTTPException, Query
-from fastapi.responses import PlainTextResponse
-from src.etl import Station, get_next_arrivals, minutes_until_arrivals
-from src.alta_parking import check_parking_availability, init_browser, close_browser
+from datetime import datetime, timedelta
+from urllib.parse import urlencode
+from zoneinfo import ZoneInfo
+import httpx
+import orjson
+from cachetools import TTLCache
+from fastapi import FastAPI, HTTPException, Query, Request, Response
+from fastapi.responses import ORJSONResponse, PlainTextResponse
+from src.etl import Station, get_next_arrivals, get_next_arrivals_for_stations, minutes_until_arrivals, warmup
+from src.alta_parking import (
+    check_parking_availability,
+    check_parking_availability_batch,
+    get_availability_calendar,
+    init_browser,
+    close_browser,
+)
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    """Manage browser lifecycle."""
-    await init_browser()
+    """Manage browser and MTA feed HTTP client lifecycle, warming the feed cache on startup."""
+    app.state.http_client = httpx.AsyncClient(http2=True, timeout=5.0)
+    await asyncio.gather(init_browser(), warmup(app.state.http_client))
     yield
     await close_browser()
+    await app.state.http_client.aclose()
 
 
-app = FastAPI(title="NYC MTA Train Arrivals API", lifespan=lifespan)
+app = FastAPI(title="NYC MTA Train Arrivals API", lifespan=lifespan, default_response_class=ORJSONResponse)
 
-# Simple cache: {date: (timestamp, result)}
-_parking_cache: dict[str, tuple[float, dict]] = {}
+# Station lookups built once at import instead of per request
+_STATION_NAMES_LOWER = tuple(s.name.lower() for s in Station)
+_STATIONS_BY_NAME = {s.name: s for s in Station}
+
+ALTA_TIMEZONE = ZoneInfo("America/Denver")
+
+# Simple cache: {date: (timestamp, result, etag)}
+_parking_cache: dict[str, tuple[float, dict, str]] = {}
 CACHE_TTL_SECONDS = 60
 
+# Raw arrival times per (station, limit). Minutes are recomputed per request so they stay fresh.
+_arrivals_cache: TTLCache = TTLCache(maxsize=64, ttl=20)
+_arrivals_locks: dict[Station, asyncio.Lock] = {s: asyncio.Lock() for s in Station}
 
-@app.get("/arrivals")
-def get_arrivals(
-    station: str = Query(..., description="Station name in lowercase with underscores (e.g., canal_st_southbound)"),
-    config: str = Query("full", description="Response format: 'full' (JSON) or 'short' (plain text with top 3 minutes)")
-):
+# Alta availability calendar, keyed by ()
+_calendar_cache: TTLCache = TTLCache(maxsize=1, ttl=1800)
+_calendar_lock = asyncio.Lock()
+
+# In-flight requests for coalesced paths: {path?sorted_query: future of (status, headers, body)}
+_COALESCED_PATHS = frozenset({"/arrivals", "/parking"})
+_inflight: dict[str, asyncio.Future] = {}
+
+# How long clients and intermediaries may reuse a response before revalidating with its ETag
+ARRIVALS_MAX_AGE_SECONDS = 15
+CALENDAR_MAX_AGE_SECONDS = 600
+
+
+def _etag(body: bytes) -> str:
+    """Strong ETag for a response body."""
+    return f'"{hashlib.blake2b(body, digest_size=8).hexdigest()}"'
+
+
+def _parking_etag(result: dict) -> str:
     """
-    Get the next train arrival times for a specified station.
+    Weak ETag for a /parking result.
+
+    Weak because hits and misses for the same result differ only in their "cached" flag.
+    """
+    return f"W/{_etag(orjson.dumps(result))}"
+
+
+def _opaque_tag(etag: str) -> str:
+    """Strip the weak prefix so If-None-Match compares tags the weak way."""
+    return etag.removeprefix("W/")
+
+
+def _with_etag(request: Request, response: Response, max_age: int, etag: str | None = None) -> Response:
+    """
+    Tag a rendered response with an ETag for conditional GETs.
 
     Args:
-        station: Station identifier (e.g., "canal_st_southbound", "court_st_northbound")
-        config: Response format - "full" returns JSON, "short" returns plain text with top 3 minutes
+        etag: Precomputed tag for the underlying data; defaults to a hash of the response body
 
     Returns:
-        JSON object with arrival times and minutes until arrival (config=full)
-        Plain text string with top 3 minutes separated by spaces (config=short)
+        A bodiless 304 if the client's If-None-Match already has this tag, otherwise the response itself
     """
-    # Convert station string to enum format (e.g., "canal_st_southbound" -> "CANAL_ST_SOUTHBOUND")
-    station_enum_name = station.upper()
+    if etag is None:
+        etag = _etag(response.body)
+    headers = {"ETag": etag, "Cache-Control": f"max-age={max_age}, must-revalidate"}
+    if "x-cache" in response.headers:
+        headers["x-cache"] = response.headers["x-cache"]
+
+    if_none_match = request.headers.get("if-none-match", "")
+    if _opaque_tag(etag) in (_opaque_tag(tag.strip()) for tag in if_none_match.split(",")):
+        return Response(status_code=304, headers=headers)
 
+    response.headers.update(headers)
+    return response
+
+
+@app.middleware("http")
+async def coalesce_identical_requests(request: Request, call_next):
+    """
+    Funnel concurrent identical GETs to /arrivals and /parking into a single handler call.
+
+    The first request runs the handler; requests with the same path, query and
+    If-None-Match that arrive while it is in flight get a copy of its response.
+    """
+    if request.method != "GET" or request.url.path not in _COALESCED_PATHS:
+        return await call_next(request)
+
+    query = urlencode(sorted(request.query_params.multi_items()))
+    key = f"{request.url.path}?{query}|{request.headers.get('if-none-match', '')}"
+
+    inflight = _inflight.get(key)
+    if inflight is not None:
+        try:
+            # Shielded so a disconnecting follower can't cancel the shared result
+            status_code, headers, body = await asyncio.shield(inflight)
+        except asyncio.CancelledError:
+            if not inflight.cancelled():
+                raise  # This follower was cancelled, not the leader
+            # The leader's client went away; run the handler for this request instead
+            return await call_next(request)
+        return Response(body, status_code=status_code, headers=headers)
+
+    future = asyncio.get_running_loop().create_future()
+    _inflight[key] = future
     try:
-        station_enum = Station[station_enum_name]
-    except KeyError:
-        available_stations = [s.name.lower() for s in Station]
+        response = await call_next(request)
+        body = b"".join([chunk async for chunk in response.body_iterator])
+        future.set_result((response.status_code, dict(response.headers), body))
+    except asyncio.CancelledError:
+        future.cancel()
+        raise
+    except Exception as e:
+        future.set_exception(e)
+        future.exception()  # Mark retrieved in case nobody else was waiting
+        raise
+    finally:
+        _inflight.pop(key, None)
+
+    return Response(body, status_code=response.status_code, headers=dict(response.headers))
+
+
+async def _get_cached_arrivals(
+    station: Station, client: httpx.AsyncClient, limit: int | None = None
+) -> tuple[list[datetime], bool]:
+    """
+    Get arrival times for a station, fetching from the MTA feed at most once per TTL.
+    With a limit, only the soonest `limit` arrivals are returned and cached.
+
+    Concurrent callers for the same station wait on the in-flight fetch instead of
+    issuing their own.
+
+    Returns:
+        Tuple of (arrival times, whether they came from the cache)
+    """
+    key = (station, limit)
+    async with _arrivals_locks[station]:
+        arrival_times = _arrivals_cache.get(key)
+        if arrival_times is not None:
+            return arrival_times, True
+
+        arrival_times = await get_next_arrivals(station, client, limit=limit)
+        _arrivals_cache[key] = arrival_times
+        return arrival_times, False
+
+
+def _parse_station(station: str) -> Station:
+    """Convert a station query value to its enum, raising a 400 if it is unknown."""
+    # Convert station string to enum format (e.g., "canal_st_southbound" -> "CANAL_ST_SOUTHBOUND")
+    station_enum = _STATIONS_BY_NAME.get(station.upper())
+
+    if station_enum is None:
         raise HTTPException(
             status_code=400,
-            detail=f"Invalid station '{station}'. Available stations: {', '.join(available_stations)}"
+            detail=f"Invalid station '{station}'. Available stations: {', '.join(_STATION_NAMES_LOWER)}"
         )
+    return station_enum
 
-    # Get arrival data
-    arrival_times = get_next_arrivals(station_enum)
-    minutes = minutes_until_arrivals(arrival_times)
-
-    # Handle short format
-    if config == "short":
-        top_three = minutes[:3]
-        return PlainTextResponse(" ".join(map(str, top_three)))
 
-    # Handle full format (default)
+def _arrivals_response(station: str, arrival_times: list[datetime], minutes: list[int]) -> dict:
+    """Build the full-format JSON payload for a station's arrivals."""
     return {
         "station": station,
         "count": len(arrival_times),
         "arrivals": [
             {
-                "arrival_time": arrival_time.isoformat(),
+                "arrival_time": arrival_time,  # orjson serializes datetimes natively
                 "minutes_until_arrival": mins
             }
             for arrival_time, mins in zip(arrival_times, minutes)
@@ -72,6 +199,69 @@ def get_arrivals(
     }
 
 
+@app.get("/arrivals")
+async def get_arrivals(
+    request: Request,
+    station: str = Query(..., description="Station name in lowercase with underscores (e.g., canal_st_southbound)"),
+    config: str = Query("full", description="Response format: 'full' (JSON) or 'short' (plain text with top 3 minutes)")
+):
+    """
+    Get the next train arrival times for a specified station.
+
+    Args:
+        station: Station identifier (e.g., "canal_st_southbound", "court_st_northbound")
+        config: Response format - "full" returns JSON, "short" returns plain text with top 3 minutes
+
+    Returns:
+        JSON object with arrival times and minutes until arrival (config=full)
+        Plain text string with top 3 minutes separated by spaces (config=short)
+    """
+    station_enum = _parse_station(station)
+
+    # Get arrival data; short format only ever needs the next three
+    limit = 3 if config == "short" else None
+    arrival_times, cached = await _get_cached_arrivals(station_enum, request.app.state.http_client, limit=limit)
+    minutes = minutes_until_arrivals(arrival_times)
+    cache_header = {"x-cache": "HIT" if cached else "MISS"}
+
+    # Handle short format
+    if config == "short":
+        response = PlainTextResponse(" ".join(map(str, minutes)), headers=cache_header)
+        return _with_etag(request, response, ARRIVALS_MAX_AGE_SECONDS)
+
+    # Handle full format (default). Returned directly so FastAPI skips jsonable_encoder.
+    response = ORJSONResponse(_arrivals_response(station, arrival_times, minutes), headers=cache_header)
+    return _with_etag(request, response, ARRIVALS_MAX_AGE_SECONDS)
+
+
+@app.get("/arrivals/batch")
+async def get_arrivals_batch(
+    request: Request,
+    stations: str = Query(..., description="Comma-separated station names (e.g., canal_st_southbound,court_st_northbound)")
+):
+    """
+    Get the next train arrival times for several stations in one request.
+    Each feed is fetched once no matter how many of the stations it serves.
+
+    Args:
+        stations: Comma-separated station identifiers
+
+    Returns:
+        JSON object mapping each station to the same payload as /arrivals (config=full)
+    """
+    station_enums = [_parse_station(name.strip()) for name in stations.split(",") if name.strip()]
+    if not station_enums:
+        raise HTTPException(status_code=400, detail="No stations given")
+
+    arrivals = await get_next_arrivals_for_stations(station_enums, request.app.state.http_client)
+
+    payload = {}
+    for station_enum, arrival_times in arrivals.items():
+        station = station_enum.name.lower()
+        payload[station] = _arrivals_response(station, arrival_times, minutes_until_arrivals(arrival_times))
+    return _with_etag(request, ORJSONResponse(payload), ARRIVALS_MAX_AGE_SECONDS)
+
+
 @app.get("/")
 def root():
     """Root endpoint with API information."""
@@ -79,15 +269,18 @@ def root():
         "message": "NYC MTA Train Arrivals API",
         "endpoints": {
             "/arrivals": "Get train arrival times for a station",
+            "/arrivals/batch": "Get train arrival times for several stations at once",
             "/parking": "Check Alta parking availability for a date",
+            "/parking/calendar": "Get the Alta parking availability calendar",
             "/docs": "Interactive API documentation"
         },
-        "available_stations": [s.name.lower() for s in Station]
+        "available_stations": _STATION_NAMES_LOWER
     }
 
 
 @app.get("/parking")
 async def get_parking_availability(
+    request: Request,
     date: str = Query(..., description="Date to check in YYYY-MM-DD format (e.g., 2025-01-15)")
 ):
     """
@@ -102,7 +295,6 @@ async def get_parking_availability(
     """
     # Validate date format
     try:
-        from datetime import datetime
         datetime.strptime(date, "%Y-%m-%d")
     except ValueError:
         raise HTTPException(
@@ -113,9 +305,9 @@ async def get_parking_availability(
     # Check cache
     now = time.time()
     if date in _parking_cache:
-        cached_time, cached_result = _parking_cache[date]
+        cached_time, cached_result, etag = _parking_cache[date]
         if now - cached_time < CACHE_TTL_SECONDS:
-            return {**cached_result, "cached": True}
+            return _with_etag(request, ORJSONResponse({**cached_result, "cached": True}), CACHE_TTL_SECONDS, etag)
 
     # Fetch fresh result
     result = await check_parking_availability(date)
@@ -126,7 +318,78 @@ async def get_parking_availability(
             detail=f"Error checking availability: {result['error']}"
         )
 
-    # Cache the result
-    _parking_cache[date] = (now, result)
+    # Cache the result, weakly tagged without the cached flag so hits and misses share an ETag
+    etag = _parking_etag(result)
+    _parking_cache[date] = (now, result, etag)
+
+    return _with_etag(request, ORJSONResponse({**result, "cached": False}), CACHE_TTL_SECONDS, etag)
+
+
+@app.get("/parking/calendar")
+async def get_parking_calendar(
+    request: Request,
+    rates: bool = Query(False, description="Also check per-date rates for the upcoming window"),
+    days: int = Query(14, ge=1, le=31, description="Number of days, starting today, to check rates for")
+):
+    """
+    Get the Alta Ski Area parking availability calendar.
+    The calendar is cached for 30 minutes; per-date rates share the 60 second /parking cache.
+
+    Args:
+        rates: Whether to include per-date rate checks
+        days: Size of the rate window, starting today (Alta local time)
+
+    Returns:
+        JSON object mapping dates to their availability status, plus per-date
+        /parking results under "rates" when requested
+    """
+    async with _calendar_lock:
+        calendar = _calendar_cache.get(())
+        cached = calendar is not None
+
+        if not cached:
+            result = await get_availability_calendar()
+            if result.get("error"):
+                raise HTTPException(
+                    status_code=500,
+                    detail=f"Error fetching calendar: {result['error']}"
+                )
+            calendar = result["calendar"]
+            if calendar is None:
+                # Don't cache a page load that never returned the calendar; retry on the next request
+                raise HTTPException(
+                    status_code=503,
+                    detail="Calendar not available - page may not have loaded"
+                )
+            _calendar_cache[()] = calendar
+
+    payload = {"calendar": calendar}
+    if rates:
+        payload["rates"] = await _get_parking_window(days)
+
+    # Per-date rates go stale with the /parking cache, well before the calendar does
+    max_age = CACHE_TTL_SECONDS if rates else CALENDAR_MAX_AGE_SECONDS
+    response = ORJSONResponse(payload, headers={"x-cache": "HIT" if cached else "MISS"})
+    return _with_etag(request, response, max_age)
+
+
+async def _get_parking_window(days: int) -> dict[str, dict]:
+    """Check parking for the next `days` dates concurrently, reusing fresh /parking cache entries."""
+    today = datetime.now(ALTA_TIMEZONE).date()
+    dates = [(today + timedelta(days=offset)).isoformat() for offset in range(days)]
+
+    now = time.time()
+    window = {}
+    for date in dates:
+        if date in _parking_cache:
+            cached_time, cached_result, _ = _parking_cache[date]
+            if now - cached_time < CACHE_TTL_SECONDS:
+                window[date] = {**cached_result, "cached": True}
+
+    missing = [date for date in dates if date not in window]
+    for date, result in (await check_parking_availability_batch(missing)).items():
+        if not result.get("error"):
+            _parking_cache[date] = (now, result, _parking_etag(result))
+        window[date] = {**result, "cached": False}
 
-    return {**result, "cached": False}
+    return {date: window[date] for date in dates}
@@ -1,6 +1,28 @@
+import asyncio
+import heapq
+import time
+from collections import defaultdict
+from dataclasses import dataclass
 from datetime import datetime
 from enum import Enum
+import httpx
 from nyct_gtfs import NYCTFeed
+from nyct_gtfs.compiled_gtfs import gtfs_realtime_pb2, nyct_subway_pb2
+
+FEED_REFRESH_SECONDS = 15
+UNDERWAY_CLOCK_SKEW_SECONDS = 60  # Same allowance nyct_gtfs uses for Trip.underway
+
+
+@dataclass
+class _CachedFeed:
+    """The per-stop arrival index built from a realtime feed on refresh."""
+    refreshed_at: float
+    arrivals_by_stop: dict[str, list[datetime]]
+
+
+# Feeds are shared by every station on a line (several lines share a feed), keyed by feed URL
+_feed_cache: dict[str, _CachedFeed] = {}
+_feed_locks: defaultdict[str, asyncio.Lock] = defaultdict(asyncio.Lock)
 
 
 class Station(Enum):
@@ -15,33 +37,145 @@ class Station(Enum):
         self.stop_name = stop_name
 
 
-def get_next_arrivals(station: Station) -> list[datetime]:
+# Only stops served by the API get arrivals materialized
+_TRACKED_STOP_IDS = frozenset(station.stop_id for station in Station)
+
+# Feed URL for every line the API serves, resolved once at import
+_FEED_URLS = {station.line_id: NYCTFeed._train_to_url[station.line_id] for station in Station}
+
+
+def _trip_identifier(trip) -> str:
+    """Key trip updates and vehicle positions the same way NYCTFeed does."""
+    return trip.trip_id + " " + trip.Extensions[nyct_subway_pb2.nyct_trip_descriptor].train_id[-7:]
+
+
+def _index_arrivals_by_stop(
+    gtfs_bytes: bytes, stop_ids: frozenset[str] = _TRACKED_STOP_IDS
+) -> dict[str, list[datetime]]:
+    """
+    Parse a GTFS-realtime feed and group arrival times of underway trains by stop_id.
+
+    Walks the raw protobuf messages instead of building nyct_gtfs Trip and
+    StopTimeUpdate wrappers, and the parsed message is dropped once indexed.
+
+    Args:
+        gtfs_bytes: The raw GTFS-realtime protobuf
+        stop_ids: Stop IDs to collect arrivals for
+
+    Returns:
+        A dict mapping stop_id (e.g. "R23S") to the unsorted arrival times at that stop
+    """
+    feed = gtfs_realtime_pb2.FeedMessage()
+    feed.ParseFromString(gtfs_bytes)
+
+    trip_updates = {}
+    vehicle_timestamps = {}
+    for entity in feed.entity:
+        if entity.HasField('trip_update'):
+            trip_updates[_trip_identifier(entity.trip_update.trip)] = entity.trip_update
+        elif entity.HasField('vehicle'):
+            vehicle_timestamps[_trip_identifier(entity.vehicle.trip)] = entity.vehicle.timestamp
+
+    # A train is underway once it has a vehicle position that isn't future-dated
+    underway_cutoff = feed.header.timestamp + UNDERWAY_CLOCK_SKEW_SECONDS
+
+    arrivals_by_stop: defaultdict[str, list[datetime]] = defaultdict(list)
+    for trip_id, trip_update in trip_updates.items():
+        vehicle_timestamp = vehicle_timestamps.get(trip_id)
+        if vehicle_timestamp is None or vehicle_timestamp > underway_cutoff:
+            continue
+        for stop_update in trip_update.stop_time_update:
+            if stop_update.stop_id in stop_ids and stop_update.HasField('arrival'):
+                arrivals_by_stop[stop_update.stop_id].append(datetime.fromtimestamp(stop_update.arrival.time))
+    return dict(arrivals_by_stop)
+
+
+async def get_arrivals_by_stop(line_id: str, client: httpx.AsyncClient) -> dict[str, list[datetime]]:
+    """
+    Get arrival times by stop_id for a line, reusing the cached feed if it is fresh enough.
+
+    Args:
+        line_id: The subway line identifier (e.g. "1", "R")
+        client: Shared HTTP client used to download the feed
+
+    Returns:
+        A dict mapping stop_id to arrival times, from a feed refreshed within the last FEED_REFRESH_SECONDS
+    """
+    feed_url = _FEED_URLS.get(line_id) or NYCTFeed._train_to_url[line_id]
+
+    async with _feed_locks[feed_url]:
+        now = time.monotonic()
+        cached = _feed_cache.get(feed_url)
+        if cached is not None and now - cached.refreshed_at < FEED_REFRESH_SECONDS:
+            return cached.arrivals_by_stop
+
+        response = await client.get(feed_url)
+        if response.status_code != 200:
+            raise RuntimeError(f"Error accessing MTA data feed: {response.content}")
+
+        cached = _CachedFeed(refreshed_at=now, arrivals_by_stop=_index_arrivals_by_stop(response.content))
+        _feed_cache[feed_url] = cached
+        return cached.arrivals_by_stop
+
+
+async def warmup(client: httpx.AsyncClient) -> None:
+    """
+    Fetch every served feed concurrently so the first requests find a hot cache. Call on app startup.
+
+    Failures are ignored; the feed is simply fetched again on first use.
+
+    Args:
+        client: Shared HTTP client used to download the feeds
+    """
+    # One line per distinct feed URL is enough
+    line_ids = {feed_url: line_id for line_id, feed_url in _FEED_URLS.items()}.values()
+    await asyncio.gather(*(get_arrivals_by_stop(line_id, client) for line_id in line_ids), return_exceptions=True)
+
+
+async def get_next_arrivals(station: Station, client: httpx.AsyncClient, limit: int | None = None) -> list[datetime]:
     """
     Get the next arrival times for trains at the specified stop.
 
     Args:
         stop: The Stop enum representing the desired station and direction
+        client: Shared HTTP client used to download the feed
+        limit: If set, only return the soonest `limit` arrivals
 
     Returns:
         A list of datetime objects representing arrival times, sorted in ascending order
     """
-    # Load the realtime feed from the MTA site
-    feed = NYCTFeed(station.line_id)
+    # Load the realtime feed from the MTA site (cached per line)
+    arrivals_by_stop = await get_arrivals_by_stop(station.line_id, client)
 
-    # Get all trains currently underway to this stop
-    trains: list[str] = feed.filter_trips(headed_for_stop_id=[station.stop_id], underway=True)
+    # Sort and return arrival times for the specified stop
+    arrival_times = arrivals_by_stop.get(station.stop_id, [])
+    if limit is not None:
+        return heapq.nsmallest(limit, arrival_times)
+    return sorted(arrival_times)
 
-    # Extract arrival times for the specified stop
-    arrival_times: list[datetime] = []
-    for train in trains:
-        for stop_update in train.stop_time_updates:
-            if stop_update.stop_name == station.stop_name:
-                if stop_update.arrival:
-                    arrival_times.append(stop_update.arrival)
-                break
 
-    # Sort and return arrival times
-    return sorted(arrival_times)
+async def get_next_arrivals_for_stations(
+    stations: list[Station], client: httpx.AsyncClient
+) -> dict[Station, list[datetime]]:
+    """
+    Get the next arrival times for several stations, fetching each line's feed only once.
+
+    Args:
+        stations: The Station enums to look up
+        client: Shared HTTP client used to download the feeds
+
+    Returns:
+        A dict mapping each station to its arrival times, sorted in ascending order
+    """
+    # Fetch the distinct feeds concurrently
+    line_ids = list(dict.fromkeys(station.line_id for station in stations))
+    indexes = await asyncio.gather(*(get_arrivals_by_stop(line_id, client) for line_id in line_ids))
+    arrivals_by_line = dict(zip(line_ids, indexes))
+
+    return {
+        station: sorted(arrivals_by_line[station.line_id].get(station.stop_id, []))
+        for station in stations
+    }
 
 
 def minutes_until_arrivals(arrival_times: list[datetime]) -> list[int]: